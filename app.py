@@ -4,16 +4,27 @@ EVE Routes - Flask Web Application
 Main application file with sales tax support
 """
 
+# Patch blocking I/O before anything imports socket/ssl so ESI and Redis calls yield to other requests
+from gevent import monkey
+monkey.patch_all()
+
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from heapq import nlargest
+from itertools import permutations
+from operator import attrgetter
+from typing import Optional
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import redis
-import json
-from eve_api import EVETradeAPI
+import orjson
+import msgspec
+from eve_api import EVETradeAPI, STATION_INFO
 
 # Configure logging
 logging.basicConfig(
@@ -25,18 +36,45 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's UTF-8 bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str),
+            mimetype='application/json'
+        )
+
 # Create Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configuration
 app.config['REDIS_URL'] = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 app.config['RATE_LIMIT_PER_MINUTE'] = int(os.getenv('RATE_LIMIT_PER_MINUTE', '10'))
 app.config['CACHE_TTL_SECONDS'] = int(os.getenv('CACHE_TTL_SECONDS', '300'))
+app.config['REDIS_MAX_CONNECTIONS'] = int(os.getenv('REDIS_MAX_CONNECTIONS', '100'))
 
 # Initialize Redis
 try:
-    redis_client = redis.from_url(app.config['REDIS_URL'])
+    # One long-lived pool shared by all greenlets; health checks catch connections dropped while idle
+    redis_pool_options = {
+        'max_connections': app.config['REDIS_MAX_CONNECTIONS'],
+        'health_check_interval': 30
+    }
+    if not app.config['REDIS_URL'].startswith('unix://'):  # UNIX sockets have no TCP keepalive
+        redis_pool_options['socket_keepalive'] = True
+    redis_pool = redis.ConnectionPool.from_url(app.config['REDIS_URL'], **redis_pool_options)
+    redis_client = redis.Redis(connection_pool=redis_pool)
     redis_client.ping()
     logger.info("Connected to Redis successfully")
 except Exception as e:
@@ -52,40 +90,112 @@ limiter = Limiter(
 )
 
 # Initialize EVE API
-eve_api = EVETradeAPI()
+eve_api = EVETradeAPI(redis_client=redis_client)
+
+# Number of opportunities returned per query
+MAX_OPPORTUNITIES = 35
+
+# Station validation, precomputed once; a route is any ordered pair of distinct hubs
+VALID_STATIONS = frozenset(STATION_INFO)
+VALID_ROUTES = frozenset(permutations(STATION_INFO, 2))
+INVALID_STATION_ERROR = f'Invalid station. Use one of: {", ".join(STATION_INFO)}'
+
+# Cache key layout
+CACHE_KEY_PATTERN = 'opportunities:*'
+SCAN_BATCH_SIZE = 500
+# Cache writes run off the response path
+_cache_pool = ThreadPoolExecutor(max_workers=2)
+# Stored response bodies end with the metadata's 'cached' flag, so a hit can flip it in place
+CACHED_FLAG_TAIL = b'"cached":false}}'
 
 def get_cache_key(from_station: str, to_station: str, max_cargo: int, min_profit: int, sales_tax: float) -> str:
     """Generate cache key for request parameters"""
     return f"opportunities:{from_station}:{to_station}:{max_cargo}:{min_profit}:{sales_tax}"
 
-def get_cached_data(cache_key: str):
-    """Get cached data from Redis"""
+def get_cached_data(cache_key: str) -> Optional[bytes]:
+    """Get cached response body from Redis"""
     if not redis_client:
         return None
     
     try:
         cached_data = redis_client.get(cache_key)
         if cached_data:
-            return json.loads(cached_data)
+            return cached_data
     except Exception as e:
         logger.error(f"Cache read error: {e}")
     
     return None
 
-def set_cached_data(cache_key: str, data, ttl_seconds: int):
-    """Set cached data in Redis"""
+def set_cached_data(cache_key: str, body: bytes, ttl_seconds: int):
+    """Set cached response body in Redis"""
     if not redis_client:
         return
     
     try:
-        redis_client.setex(
-            cache_key,
-            ttl_seconds,
-            json.dumps(data, default=str)
-        )
+        redis_client.setex(cache_key, ttl_seconds, body)
     except Exception as e:
         logger.error(f"Cache write error: {e}")
 
+class OpportunityOut(msgspec.Struct):
+    """API representation of a TradeOpportunity"""
+    item_id: int
+    item_name: str
+    buy_price: float
+    sell_price: float
+    actual_sell_price: float
+    profit_per_unit: float
+    profit_margin: float
+    volume: float
+    max_units: int
+    total_weight: float
+    total_profit: float
+    investment: float
+    sales_tax_paid: float
+
+class OpportunitiesMetadata(msgspec.Struct):
+    """Query metadata for an opportunities response; 'cached' must stay last (see CACHED_FLAG_TAIL)"""
+    from_station: str
+    to_station: str
+    max_cargo: int
+    min_profit: int
+    sales_tax: float
+    total_found: int
+    showing: int
+    query_time_seconds: float
+    timestamp: str
+    cached: bool
+
+# TradeOpportunity attributes, in OpportunityOut field order
+_opportunity_values = attrgetter(
+    'item_id', 'item_name', 'buy_price', 'sell_price', 'actual_sell_price',
+    'profit_per_unit', 'profit_margin', 'volume', 'max_units', 'total_weight',
+    'total_profit_potential', 'isk_investment', 'sales_tax_amount'
+)
+_json_encoder = msgspec.json.Encoder()
+
+def opportunity_to_struct(opp) -> OpportunityOut:
+    """Convert a TradeOpportunity to its API representation"""
+    return OpportunityOut(*_opportunity_values(opp))
+
+def stream_opportunities(opportunities, metadata: OpportunitiesMetadata, cache_key: str, ttl_seconds: int):
+    """Yield the opportunities response as JSON chunks, caching the body once fully sent"""
+    chunks = [b'{"opportunities":[']
+    yield chunks[0]
+    for i, opp in enumerate(opportunities):
+        chunks.append((b',' if i else b'') + _json_encoder.encode(opportunity_to_struct(opp)))
+        yield chunks[-1]
+    chunks.append(b'],"metadata":' + _json_encoder.encode(metadata) + b'}')
+    yield chunks[-1]
+    
+    # Cache the serialized body so hits skip decoding and re-encoding
+    _cache_pool.submit(set_cached_data, cache_key, b''.join(chunks), ttl_seconds)
+
+def mark_cached(body: bytes, cache_key: str) -> Optional[bytes]:
+    """Set metadata.cached on a stored response body, or None if it isn't one we wrote"""
+    if not body.endswith(CACHED_FLAG_TAIL):
+        return None
+    return body[:-len(CACHED_FLAG_TAIL)] + b'"cached":true,"cache_key":' + orjson.dumps(cache_key) + b'}}'
+
 @app.route('/')
 def index():
     """Serve the main page"""
@@ -126,13 +236,12 @@ def get_opportunities():
         sales_tax = float(request.args.get('sales_tax', 7.5))
         
         # Validate parameters
-        valid_stations = ['jita', 'dodixie', 'amarr', 'rens', 'hek']
-        if from_station not in valid_stations or to_station not in valid_stations:
-            return jsonify({
-                'error': f'Invalid station. Use one of: {", ".join(valid_stations)}'
-            }), 400
-        
-        if from_station == to_station:
+        if (from_station, to_station) not in VALID_ROUTES:
+            if from_station not in VALID_STATIONS or to_station not in VALID_STATIONS:
+                return jsonify({
+                    'error': INVALID_STATION_ERROR
+                }), 400
+            
             return jsonify({
                 'error': 'From and to stations cannot be the same'
             }), 400
@@ -154,18 +263,12 @@ def get_opportunities():
         
         # Check cache first
         cache_key = get_cache_key(from_station, to_station, max_cargo, min_profit, sales_tax)
-        cached_result = get_cached_data(cache_key)
+        cached_body = get_cached_data(cache_key)
+        cached_body = mark_cached(cached_body, cache_key) if cached_body else None
         
-        if cached_result:
+        if cached_body:
             logger.info(f"Returning cached result for {from_station}→{to_station}")
-            return jsonify({
-                'opportunities': cached_result['opportunities'],
-                'metadata': {
-                    **cached_result['metadata'],
-                    'cached': True,
-                    'cache_key': cache_key
-                }
-            })
+            return Response(cached_body, mimetype='application/json', headers={'X-Cache': 'HIT'})
         
         # Get fresh data
         start_time = datetime.utcnow()
@@ -182,48 +285,34 @@ def get_opportunities():
         end_time = datetime.utcnow()
         duration = (end_time - start_time).total_seconds()
         
-        # Convert opportunities to dict format
-        opportunities_data = []
-        for opp in opportunities[:35]:  # Limit to top 35
-            max_units = min(opp.max_units_by_cargo, opp.max_units_by_orders)
-            opportunities_data.append({
-                'item_id': opp.item_id,
-                'item_name': opp.item_name,
-                'buy_price': opp.buy_price,
-                'sell_price': opp.sell_price,
-                'actual_sell_price': opp.actual_sell_price,
-                'profit_per_unit': opp.profit_per_unit,
-                'profit_margin': opp.profit_margin,
-                'volume': opp.volume,
-                'max_units': max_units,
-                'total_weight': max_units * opp.volume,
-                'total_profit': opp.total_profit_potential,
-                'investment': opp.isk_investment,
-                'sales_tax_paid': opp.sales_tax_amount
-            })
+        # Top opportunities by total profit, without sorting the discarded tail
+        top_opportunities = nlargest(MAX_OPPORTUNITIES, opportunities, key=attrgetter('total_profit_potential'))
         
-        # Prepare response
-        result = {
-            'opportunities': opportunities_data,
-            'metadata': {
-                'from_station': from_station,
-                'to_station': to_station,
-                'max_cargo': max_cargo,
-                'min_profit': min_profit,
-                'sales_tax': sales_tax,
-                'total_found': len(opportunities),
-                'showing': len(opportunities_data),
-                'query_time_seconds': round(duration, 2),
-                'timestamp': end_time.isoformat(),
-                'cached': False
-            }
-        }
-        
-        # Cache the result
-        set_cached_data(cache_key, result, app.config['CACHE_TTL_SECONDS'])
+        # Prepare response metadata
+        metadata = OpportunitiesMetadata(
+            from_station=from_station,
+            to_station=to_station,
+            max_cargo=max_cargo,
+            min_profit=min_profit,
+            sales_tax=sales_tax,
+            total_found=len(opportunities),
+            showing=len(top_opportunities),
+            query_time_seconds=round(duration, 2),
+            timestamp=end_time.isoformat(),
+            cached=False
+        )
         
         logger.info(f"Found {len(opportunities)} opportunities in {duration:.2f}s")
-        return jsonify(result)
+        return Response(
+            stream_opportunities(
+                top_opportunities,
+                metadata,
+                cache_key,
+                app.config['CACHE_TTL_SECONDS']
+            ),
+            mimetype='application/json',
+            headers={'X-Cache': 'MISS'}
+        )
         
     except ValueError as e:
         logger.error(f"Parameter validation error: {e}")
@@ -242,8 +331,14 @@ def cache_stats():
         return jsonify({'error': 'Redis not available'}), 503
     
     try:
-        info = redis_client.info()
-        keys = redis_client.keys('opportunities:*')
+        # INFO and the first SCAN page share one round-trip
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.info()
+        pipe.scan(cursor=0, match=CACHE_KEY_PATTERN, count=SCAN_BATCH_SIZE)
+        info, (cursor, keys) = pipe.execute()
+        while cursor:
+            cursor, batch = redis_client.scan(cursor=cursor, match=CACHE_KEY_PATTERN, count=SCAN_BATCH_SIZE)
+            keys.extend(batch)
         
         return jsonify({
             'redis_info': {
@@ -266,13 +361,20 @@ def clear_cache():
         return jsonify({'error': 'Redis not available'}), 503
     
     try:
-        keys = redis_client.keys('opportunities:*')
-        if keys:
-            redis_client.delete(*keys)
+        pipe = redis_client.pipeline(transaction=False)
+        batch = []
+        for key in redis_client.scan_iter(match=CACHE_KEY_PATTERN, count=SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                pipe.delete(*batch)
+                batch = []
+        if batch:
+            pipe.delete(*batch)
+        cleared = sum(pipe.execute())
         
         return jsonify({
-            'message': f'Cleared {len(keys)} cache entries',
-            'cleared_keys': len(keys)
+            'message': f'Cleared {cleared} cache entries',
+            'cleared_keys': cleared
         })
     except Exception as e:
         logger.error(f"Error clearing cache: {e}")
@@ -5,16 +5,80 @@ Updated with sales tax calculations and all major trade hubs
 """
 
 import requests
-import json
+import cachetools
+import msgpack
+import numpy as np
+import orjson
+import pandas as pd
 import time
 import logging
-from typing import Dict, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Shared Redis cache for item metadata (names/volumes rarely change)
+TYPES_CACHE_KEY = 'eve:types'
+TYPES_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Bounded in-process item name cache in front of the Redis one
+_item_name_cache = cachetools.TTLCache(maxsize=50000, ttl=86400)
+
+# Orders are kept as one NumPy array per field rather than a dict per order
+ORDER_DTYPES = {
+    'type_id': np.int32,
+    'price': np.float64,
+    'volume_remain': np.int32
+}
+
+def _orders_to_arrays(orders: List[Dict]) -> Dict[str, np.ndarray]:
+    """Convert ESI order dicts to per-field arrays"""
+    return {
+        field: np.fromiter((order[field] for order in orders), dtype=dtype, count=len(orders))
+        for field, dtype in ORDER_DTYPES.items()
+    }
+
+def _best_orders(orders: Dict[str, np.ndarray], highest: bool) -> pd.DataFrame:
+    """Pick the best-priced order per type_id (highest or lowest price, first seen on ties)"""
+    type_ids = orders['type_id']
+    if len(type_ids) == 0:
+        return pd.DataFrame({field: column for field, column in orders.items()})
+    
+    # Stable sort by type_id then price, so each group's first row is its best order
+    price = -orders['price'] if highest else orders['price']
+    order = np.lexsort((price, type_ids))
+    sorted_ids = type_ids[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    best = order[group_starts]
+    return pd.DataFrame({field: column[best] for field, column in orders.items()})
+
+# Region IDs for all major trade hubs
+REGIONS = {
+    'jita': 10000002,      # The Forge (Jita)
+    'dodixie': 10000032,   # Sinq Laison (Dodixie)
+    'amarr': 10000043,     # Domain (Amarr)
+    'rens': 10000030,      # Heimatar (Rens)
+    'hek': 10000042        # Metropolis (Hek)
+}
+
+# Station IDs for all major trade hubs
+STATIONS = {
+    'jita': 60003760,      # Jita IV - Moon 4 - Caldari Navy Assembly Plant
+    'dodixie': 60011866,   # Dodixie IX - Moon 20 - Federation Navy Assembly Plant
+    'amarr': 60008494,     # Amarr VIII (Oris) - Emperor Family Academy
+    'rens': 60004588,      # Rens VI - Moon 8 - Brutor Tribe Treasury
+    'hek': 60005686       # Hek VIII - Moon 12 - Boundless Creation Factory
+}
+
+# (region_id, station_id) per hub, resolved once instead of per request
+STATION_INFO = {name: (REGIONS[name], STATIONS[name]) for name in REGIONS}
+
+@dataclass(slots=True, frozen=True)
 class TradeOpportunity:
     item_id: int
     item_name: str
@@ -29,9 +93,12 @@ class TradeOpportunity:
     total_profit_potential: float
     isk_investment: float
     sales_tax_amount: float  # Total sales tax paid
+    max_units: int  # Units actually tradeable (cargo and order limited)
+    total_weight: float  # Cargo volume of max_units
 
 class EVETradeAPI:
-    def __init__(self):
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client
         self.base_url = "https://esi.evetech.net/latest"
         self.session = requests.Session()
         self.session.headers.update({
@@ -39,293 +106,288 @@ class EVETradeAPI:
             'Accept': 'application/json'
         })
         
-        # Region IDs for all major trade hubs
-        self.regions = {
-            'jita': 10000002,      # The Forge (Jita)
-            'dodixie': 10000032,   # Sinq Laison (Dodixie)
-            'amarr': 10000043,     # Domain (Amarr)
-            'rens': 10000030,      # Heimatar (Rens)
-            'hek': 10000042        # Metropolis (Hek)
-        }
-        
-        # Station IDs for all major trade hubs
-        self.stations = {
-            'jita': 60003760,      # Jita IV - Moon 4 - Caldari Navy Assembly Plant
-            'dodixie': 60011866,   # Dodixie IX - Moon 20 - Federation Navy Assembly Plant
-            'amarr': 60008494,     # Amarr VIII (Oris) - Emperor Family Academy
-            'rens': 60004588,      # Rens VI - Moon 8 - Brutor Tribe Treasury
-            'hek': 60005686       # Hek VIII - Moon 12 - Boundless Creation Factory
-        }
-        
-        self.type_names = {}  # Cache for item names
-        
-        # Rate limiting
-        self.last_request_time = 0
-        self.min_request_interval = 0.1  # 100ms between requests
+        # Concurrent fetches share the session's keep-alive pool; transient ESI errors are retried
+        self.order_page_workers = 16
+        self.type_info_workers = 32
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=0.3,
+                status_forcelist=[429, 502, 503, 504],
+                respect_retry_after_header=True,
+                raise_on_status=False  # Hand the last response back so callers can log its status
+            )
+        ))
+        
+        self.regions = REGIONS
+        self.stations = STATIONS
+        
+        # Rate limiting (shared across worker threads)
+        self.max_requests_per_second = 100
+        self._next_request_time = 0.0
+        self._rate_lock = threading.Lock()
         
     def _rate_limited_request(self, url: str, params: dict = None, timeout: int = 30) -> Optional[requests.Response]:
         """Make a rate-limited request to EVE API"""
-        # Ensure we don't exceed rate limits
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.min_request_interval:
-            time.sleep(self.min_request_interval - time_since_last)
+        # Reserve the next free request slot; requests may overlap in flight
+        with self._rate_lock:
+            current_time = time.monotonic()
+            wait = self._next_request_time - current_time
+            self._next_request_time = max(current_time, self._next_request_time) + 1 / self.max_requests_per_second
+        if wait > 0:
+            time.sleep(wait)
         
         try:
             response = self.session.get(url, params=params, timeout=timeout)
-            self.last_request_time = time.time()
             return response
         except requests.exceptions.RequestException as e:
             logger.error(f"Request failed: {url} - {e}")
             return None
         
+    @cachetools.cached(
+        cache=_item_name_cache,
+        key=lambda self, type_id: cachetools.keys.hashkey(type_id),
+        lock=threading.Lock()
+    )
     def get_item_name(self, type_id: int) -> str:
         """Get item name by type_id with caching"""
-        if type_id not in self.type_names:
-            try:
-                url = f"{self.base_url}/universe/types/{type_id}/"
-                response = self._rate_limited_request(url)
+        type_info = self._get_types_cached([type_id]).get(type_id)
+        if type_info:
+            return type_info['name']
+        return f'Unknown_{type_id}'
+    
+    def _fetch_orders_page(self, region_id: int, order_type: str, page: int,
+                           station_id: Optional[int] = None) -> Tuple[Dict[str, np.ndarray], int]:
+        """Fetch a single page of market orders, returning the orders and total page count"""
+        try:
+            url = f"{self.base_url}/markets/{region_id}/orders/"
+            params = {
+                'order_type': order_type,
+                'page': page
+            }
+            
+            response = self._rate_limited_request(url, params)
+            
+            if response is None:
+                logger.error(f"No response for page {page}")
+                return _orders_to_arrays([]), 0
+            
+            if response.status_code == 200:
+                orders = orjson.loads(response.content)
+                # Drop other stations' orders before they pile up across pages
+                if station_id is not None:
+                    orders = [order for order in orders if order['location_id'] == station_id]
+                return _orders_to_arrays(orders), int(response.headers.get('X-Pages', 1))
+            
+            if response.status_code != 404:  # 404 means no such page
+                logger.error(f"Error fetching orders page {page}: {response.status_code}")
                 
-                if response and response.status_code == 200:
-                    data = response.json()
-                    self.type_names[type_id] = data.get('name', f'Unknown_{type_id}')
-                else:
-                    logger.warning(f"Failed to get name for type_id {type_id}")
-                    self.type_names[type_id] = f'Unknown_{type_id}'
-                    
-            except Exception as e:
-                logger.error(f"Error getting item name for {type_id}: {e}")
-                self.type_names[type_id] = f'Error_{type_id}'
-        
-        return self.type_names[type_id]
+        except Exception as e:
+            logger.error(f"Exception fetching page {page}: {e}")
+        
+        return _orders_to_arrays([]), 0
     
-    def get_market_orders(self, region_id: int, order_type: str = 'all') -> List[Dict]:
-        """Get market orders for a region with improved error handling"""
-        all_orders = []
-        page = 1
+    def get_market_orders(self, region_id: int, order_type: str = 'all',
+                          station_id: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Get market orders for a region (optionally a single station), fetching pages concurrently"""
         max_pages = 50  # Safety limit
         
         logger.info(f"Fetching {order_type} orders for region {region_id}")
         
-        while page <= max_pages:
-            try:
-                url = f"{self.base_url}/markets/{region_id}/orders/"
-                params = {
-                    'order_type': order_type,
-                    'page': page
-                }
-                
-                response = self._rate_limited_request(url, params)
-                
-                if response is None:
-                    logger.error(f"No response for page {page}")
-                    break
-                
-                if response.status_code == 200:
-                    orders = response.json()
-                    if not orders:  # Empty page means we're done
-                        break
-                    all_orders.extend(orders)
-                    page += 1
-                    
-                    if page % 10 == 0:
-                        logger.info(f"Fetched {page-1} pages, {len(all_orders)} orders so far")
-                        
-                elif response.status_code == 404:
-                    # No more pages
-                    break
-                else:
-                    logger.error(f"Error fetching orders page {page}: {response.status_code}")
-                    break
-                    
-            except Exception as e:
-                logger.error(f"Exception fetching page {page}: {e}")
-                break
+        # The first page tells us how many pages there are
+        first_page, total_pages = self._fetch_orders_page(region_id, order_type, 1, station_id)
+        pages = min(total_pages, max_pages)
+        
+        if pages > 1:
+            logger.info(f"Fetching {pages - 1} more pages with {self.order_page_workers} workers")
+            with ThreadPoolExecutor(max_workers=self.order_page_workers) as executor:
+                results = executor.map(
+                    lambda page: self._fetch_orders_page(region_id, order_type, page, station_id)[0],
+                    range(2, pages + 1)
+                )
+                page_arrays = [first_page, *results]
+            all_orders = {
+                field: np.concatenate([arrays[field] for arrays in page_arrays])
+                for field in ORDER_DTYPES
+            }
+        else:
+            all_orders = first_page
                 
-        logger.info(f"Finished fetching orders: {len(all_orders)} total")
+        logger.info(f"Finished fetching orders: {len(all_orders['type_id'])} total")
         return all_orders
     
-    def filter_station_orders(self, orders: List[Dict], station_id: int) -> List[Dict]:
-        """Filter orders by station"""
-        return [order for order in orders if order['location_id'] == station_id]
+    def _fetch_type(self, type_id: int) -> Optional[Dict]:
+        """Fetch raw type data for a single type_id"""
+        url = f"{self.base_url}/universe/types/{type_id}/"
+        response = self._rate_limited_request(url)
+        
+        if response and response.status_code == 200:
+            return orjson.loads(response.content)
+        
+        logger.warning(f"Failed to get info for type_id {type_id}")
+        return None
     
     def get_types_info_batch(self, type_ids: List[int]) -> Dict[int, Dict]:
-        """Get type information with better error handling"""
+        """Get type information, fetching types concurrently"""
         types_info = {}
         
         logger.info(f"Fetching info for {len(type_ids)} item types")
         
-        for i, type_id in enumerate(type_ids):
-            try:
-                url = f"{self.base_url}/universe/types/{type_id}/"
-                response = self._rate_limited_request(url)
+        with ThreadPoolExecutor(max_workers=self.type_info_workers) as executor:
+            futures = {executor.submit(self._fetch_type, type_id): type_id for type_id in type_ids}
+            
+            for i, future in enumerate(as_completed(futures)):
+                type_id = futures[future]
+                try:
+                    data = future.result()
+                    if data:
+                        types_info[type_id] = {
+                            'name': data.get('name', f'Unknown_{type_id}'),
+                            'volume': data.get('volume', 0)
+                        }
+                except Exception as e:
+                    logger.error(f"Error fetching info for type_id {type_id}: {e}")
                 
-                if response and response.status_code == 200:
-                    data = response.json()
-                    types_info[type_id] = {
-                        'name': data.get('name', f'Unknown_{type_id}'),
-                        'volume': data.get('volume', 0)
-                    }
-                else:
-                    logger.warning(f"Failed to get info for type_id {type_id}")
-                    
                 # Progress logging
                 if (i + 1) % 50 == 0:
                     logger.info(f"Fetched info for {i + 1}/{len(type_ids)} items")
-                    
-            except Exception as e:
-                logger.error(f"Error fetching info for type_id {type_id}: {e}")
-                continue
                 
         logger.info(f"Successfully fetched info for {len(types_info)} items")
         return types_info
 
+    def _get_types_cached(self, type_ids: List[int]) -> Dict[int, Dict]:
+        """Get type information from the shared Redis cache, fetching only misses from ESI"""
+        if not self.redis_client or not type_ids:
+            return self.get_types_info_batch(type_ids)
+        
+        # Hash fields are decimal type_id strings; one HMGET covers the whole batch
+        type_ids = list(dict.fromkeys(type_ids))
+        types_info = {}
+        try:
+            cached = self.redis_client.hmget(TYPES_CACHE_KEY, [str(type_id) for type_id in type_ids])
+            for type_id, blob in zip(type_ids, cached):
+                if blob is not None:
+                    types_info[type_id] = msgpack.unpackb(blob, raw=False)
+        except Exception as e:
+            logger.error(f"Type cache read error: {e}")
+        
+        missing = [type_id for type_id in type_ids if type_id not in types_info]
+        logger.info(f"Type cache: {len(types_info)} hits, {len(missing)} misses")
+        
+        if missing:
+            fetched = self.get_types_info_batch(missing)
+            types_info.update(fetched)
+            
+            if fetched:
+                try:
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    pipe.hset(TYPES_CACHE_KEY, mapping={
+                        str(type_id): msgpack.packb(info, use_bin_type=True)
+                        for type_id, info in fetched.items()
+                    })
+                    # Only start the clock when the hash is created so entries refresh weekly
+                    pipe.expire(TYPES_CACHE_KEY, TYPES_CACHE_TTL_SECONDS, nx=True)
+                    pipe.execute()
+                except Exception as e:
+                    logger.error(f"Type cache write error: {e}")
+        
+        return types_info
+
     def find_trade_opportunities(self, from_station: str, to_station: str, 
                                max_cargo: float = 33500, min_profit: float = 100000, 
                                sales_tax: float = 7.5) -> List[TradeOpportunity]:
-        """Find trade opportunities between two stations with sales tax calculations"""
+        """Find trade opportunities between two stations with sales tax calculations.
+        
+        Results are unordered; callers rank them by total_profit_potential as needed.
+        """
         
         logger.info(f"Starting trade analysis: {from_station.upper()} → {to_station.upper()}")
         logger.info(f"Parameters: cargo={max_cargo:,.0f}m³, min_profit={min_profit:,.0f} ISK, sales_tax={sales_tax:.2f}%")
         
-        # Validate station names
-        if from_station.lower() not in self.regions:
+        # Validate station names and get region and station IDs
+        from_info = STATION_INFO.get(from_station.lower())
+        to_info = STATION_INFO.get(to_station.lower())
+        if from_info is None:
             raise ValueError(f"Unknown station: {from_station}")
-        if to_station.lower() not in self.stations:
+        if to_info is None:
             raise ValueError(f"Unknown station: {to_station}")
         
-        # Get region and station IDs
-        from_region = self.regions[from_station.lower()]
-        to_region = self.regions[to_station.lower()]
-        from_station_id = self.stations[from_station.lower()]
-        to_station_id = self.stations[to_station.lower()]
-        
-        # Get market orders
-        from_orders = self.get_market_orders(from_region, 'sell')
-        to_orders = self.get_market_orders(to_region, 'buy')
+        from_region, from_station_id = from_info
+        to_region, to_station_id = to_info
         
-        logger.info(f"Retrieved {len(from_orders)} sell orders and {len(to_orders)} buy orders")
+        # Get market orders, filtered to the stations as pages arrive
+        from_station_orders = self.get_market_orders(from_region, 'sell', from_station_id)
+        to_station_orders = self.get_market_orders(to_region, 'buy', to_station_id)
         
-        # Filter by stations
-        from_station_orders = self.filter_station_orders(from_orders, from_station_id)
-        to_station_orders = self.filter_station_orders(to_orders, to_station_id)
+        logger.info(f"Retrieved {len(from_station_orders['type_id'])} sell orders and {len(to_station_orders['type_id'])} buy orders at stations")
         
-        logger.info(f"Filtered to {len(from_station_orders)} sell orders and {len(to_station_orders)} buy orders at stations")
-        
-        # Create price lookup dictionaries
-        sell_orders = {}  # type_id -> list of orders
-        buy_orders = {}   # type_id -> list of orders
-        
-        for order in from_station_orders:
-            type_id = order['type_id']
-            if type_id not in sell_orders:
-                sell_orders[type_id] = []
-            sell_orders[type_id].append(order)
-            
-        for order in to_station_orders:
-            type_id = order['type_id']
-            if type_id not in buy_orders:
-                buy_orders[type_id] = []
-            buy_orders[type_id].append(order)
+        # Best price per item: lowest sell at the source, highest buy at the destination
+        best_sells = _best_orders(from_station_orders, highest=False)
+        best_buys = _best_orders(to_station_orders, highest=True)
         
         # Find potentially profitable items
-        common_items = list(set(sell_orders.keys()) & set(buy_orders.keys()))
-        logger.info(f"Found {len(common_items)} common items between stations")
+        merged = best_sells.merge(best_buys, on='type_id', suffixes=('_sell', '_buy'))
+        logger.info(f"Found {len(merged)} common items between stations")
         
         # Pre-filter profitable items with sales tax consideration
-        potentially_profitable = []
         sales_tax_multiplier = 1 - (sales_tax / 100)
+        merged['actual_sell_price'] = merged['price_buy'] * sales_tax_multiplier  # After sales tax
+        merged['profit_per_unit'] = merged['actual_sell_price'] - merged['price_sell']
+        # Only keep items with decent profit per unit (10k ISK minimum)
+        merged = merged[merged['profit_per_unit'] >= 10000]
         
-        for type_id in common_items:
-            try:
-                # Get best prices
-                best_sell = min(sell_orders[type_id], key=lambda x: x['price'])
-                best_buy = max(buy_orders[type_id], key=lambda x: x['price'])
-                
-                buy_price = best_sell['price']
-                sell_price = best_buy['price']
-                actual_sell_price = sell_price * sales_tax_multiplier  # After sales tax
-                
-                if actual_sell_price > buy_price:
-                    profit_per_unit = actual_sell_price - buy_price
-                    # Only keep items with decent profit per unit
-                    if profit_per_unit >= 10000:  # 10k ISK minimum
-                        potentially_profitable.append({
-                            'type_id': type_id,
-                            'buy_price': buy_price,
-                            'sell_price': sell_price,
-                            'actual_sell_price': actual_sell_price,
-                            'profit_per_unit': profit_per_unit,
-                            'best_sell_volume': best_sell['volume_remain'],
-                            'best_buy_volume': best_buy['volume_remain']
-                        })
-            except Exception as e:
-                logger.error(f"Error processing type_id {type_id}: {e}")
-                continue
-        
-        logger.info(f"Found {len(potentially_profitable)} potentially profitable items (after sales tax)")
+        logger.info(f"Found {len(merged)} potentially profitable items (after sales tax)")
+        
+        if merged.empty:
+            return []
         
         # Get detailed type information
-        type_ids = [item['type_id'] for item in potentially_profitable]
-        types_info = self.get_types_info_batch(type_ids)
+        type_ids = merged['type_id'].astype(int).tolist()
+        types_info = self._get_types_cached(type_ids)
+        types = pd.DataFrame(
+            [(type_id, info.get('name', f'Unknown_{type_id}'), info.get('volume', 0))
+             for type_id, info in types_info.items()],
+            columns=['type_id', 'item_name', 'volume']
+        )
+        merged = merged.merge(types.astype({'type_id': merged['type_id'].dtype}), on='type_id')
+        merged = merged[merged['volume'] > 0]
         
-        # Calculate final opportunities
-        opportunities = []
+        # Calculate opportunity metrics
+        merged['profit_margin'] = (merged['profit_per_unit'] / merged['price_sell']) * 100
+        merged['max_units_by_cargo'] = (max_cargo / merged['volume']).astype('int64')
+        merged['max_units_by_orders'] = merged[['volume_remain_sell', 'volume_remain_buy']].min(axis=1)
+        merged['max_units'] = merged[['max_units_by_cargo', 'max_units_by_orders']].min(axis=1)
+        merged = merged[merged['max_units'] > 0]
+        merged['total_weight'] = merged['max_units'] * merged['volume']
         
-        for item in potentially_profitable:
-            type_id = item['type_id']
-            
-            if type_id not in types_info:
-                continue
-                
-            type_info = types_info[type_id]
-            volume = type_info.get('volume', 0)
-            
-            if volume <= 0:
-                continue
-            
-            # Calculate opportunity metrics
-            profit_per_unit = item['profit_per_unit']
-            profit_margin = (profit_per_unit / item['buy_price']) * 100
-            
-            # Calculate maximum units
-            max_units_by_cargo = int(max_cargo / volume)
-            max_units_by_orders = min(item['best_sell_volume'], item['best_buy_volume'])
-            max_units = min(max_units_by_cargo, max_units_by_orders)
-            
-            if max_units <= 0:
-                continue
-                
-            total_profit = profit_per_unit * max_units
-            isk_investment = item['buy_price'] * max_units
-            
-            # Calculate total sales tax paid
-            sales_tax_per_unit = item['sell_price'] - item['actual_sell_price']
-            total_sales_tax = sales_tax_per_unit * max_units
-            
-            if total_profit >= min_profit:
-                item_name = type_info.get('name', f'Unknown_{type_id}')
-                
-                opportunity = TradeOpportunity(
-                    item_id=type_id,
-                    item_name=item_name,
-                    buy_price=item['buy_price'],
-                    sell_price=item['sell_price'],
-                    actual_sell_price=item['actual_sell_price'],
-                    profit_per_unit=profit_per_unit,
-                    profit_margin=profit_margin,
-                    volume=volume,
-                    max_units_by_cargo=max_units_by_cargo,
-                    max_units_by_orders=max_units_by_orders,
-                    total_profit_potential=total_profit,
-                    isk_investment=isk_investment,
-                    sales_tax_amount=total_sales_tax
-                )
-                
-                opportunities.append(opportunity)
+        merged['total_profit'] = merged['profit_per_unit'] * merged['max_units']
+        merged['isk_investment'] = merged['price_sell'] * merged['max_units']
+        # Calculate total sales tax paid
+        merged['total_sales_tax'] = (merged['price_buy'] - merged['actual_sell_price']) * merged['max_units']
+        merged = merged[merged['total_profit'] >= min_profit]
         
-        # Sort by total profit potential
-        opportunities.sort(key=lambda x: x.total_profit_potential, reverse=True)
+        opportunities = [
+            TradeOpportunity(
+                item_id=int(row.type_id),
+                item_name=row.item_name,
+                buy_price=float(row.price_sell),
+                sell_price=float(row.price_buy),
+                actual_sell_price=float(row.actual_sell_price),
+                profit_per_unit=float(row.profit_per_unit),
+                profit_margin=float(row.profit_margin),
+                volume=float(row.volume),
+                max_units_by_cargo=int(row.max_units_by_cargo),
+                max_units_by_orders=int(row.max_units_by_orders),
+                total_profit_potential=float(row.total_profit),
+                isk_investment=float(row.isk_investment),
+                sales_tax_amount=float(row.total_sales_tax),
+                max_units=int(row.max_units),
+                total_weight=float(row.total_weight)
+            )
+            for row in merged.itertuples(index=False)
+        ]
         
         logger.info(f"Analysis complete: {len(opportunities)} profitable opportunities found")
         